@@ -35,7 +35,7 @@ Examples:
         nargs="+",
         default=[440.0],
         metavar="HZ",
-        help="Sine wave frequencies in Hz (default: %(default)s Hz)",
+        help="Sine wave frequencies in Hz, repeated to fill all channels (default: %(default)s Hz)",
     )
     audio_group.add_argument(
         "-v",
@@ -71,7 +71,7 @@ Examples:
         type=int,
         choices=[16, 24, 32],
         metavar="BITS",
-        help="Audio bit depth: 16, 24, or 32 bits (default: %(default)s)",
+        help="Audio bit depth: 16 (integer), 24 (WAV only, float), or 32 (float) bits (default: %(default)s)",
     )
 
     # Output Settings
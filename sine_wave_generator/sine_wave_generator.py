@@ -1,11 +1,19 @@
+import math
+import os
 import random
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 
 import numpy as np
 import pyaudio
 from scipy.io import wavfile
 
+# PortAudio sample format for each supported bit depth
+_BITDEPTH_MAP = {16: pyaudio.paInt16, 24: pyaudio.paInt24, 32: pyaudio.paFloat32}
+# Output sample dtype for each bit depth; 24-bit has no packed conversion yet and stays float32
+_SAMPLE_DTYPES = {16: np.int16, 24: np.float32, 32: np.float32}
+
 
 class GlitchType(Enum):
     NONE = 0
@@ -14,6 +22,29 @@ class GlitchType(Enum):
     FULLSCALE = 3
 
 
+class _OscillatorState:
+    """Phasor state, and the cached period if there is one, for one set of frequencies.
+
+    set_frequencies() builds a complete new state and publishes it in a single assignment, and the
+    render methods read it once per call, so a change during playback never mixes two sets.
+    """
+
+    def __init__(self, frequencies, sample_rate, arange_chunk):
+        self.freqs_arr = np.asarray(frequencies, dtype=np.float64)
+        self.delta_theta = (2 * np.pi * self.freqs_arr) / sample_rate  # Δθ = 2πf / fs
+        self.phasors = np.ones(len(self.freqs_arr), dtype=np.complex128)
+        # e^(jnΔθ), stored in single precision since only float32 samples are produced from it
+        self.rotations = np.exp(1j * self.delta_theta[:, None] * arange_chunk).astype(np.complex64)
+        # Per-chunk state for _render_chunk, so steady-state playback allocates nothing
+        self.chunk_step = np.exp(1j * len(arange_chunk) * self.delta_theta)
+        self.chunk_phasors = np.empty((len(self.freqs_arr), 1), dtype=np.complex64)
+        self.magnitudes = np.ones(len(self.freqs_arr), dtype=np.float64)
+        # One exact period of the signal, filled in by SineWaveGenerator._build_period_table when it is short
+        self.period_table = None
+        self.period = None
+        self.period_offset = 0
+
+
 class SineWaveGenerator:
     """Audio sine wave generator with optional glitch effects.
 
@@ -26,6 +57,10 @@ class SineWaveGenerator:
     MIN_SAMPLE_RATE = 8000
     MAX_SAMPLE_RATE = 192000
     MAX_CHUNK_SIZE = 8192
+    RENDER_TILE_SAMPLES = 16384
+    PARALLEL_RENDER_SAMPLES = 131072
+    RING_BUFFER_CHUNKS = 4
+    MAX_PERIOD_TABLE_BYTES = 65536
     GLITCH_INTERVAL_SECONDS = 1.0
     THREAD_STOP_TIMEOUT = 5.0
 
@@ -78,14 +113,29 @@ class SineWaveGenerator:
             raise ValueError("Glitch interval range minimum must be <= maximum")
 
         self.sample_rate = sample_rate
-        self.frequencies = frequencies
+        self.frequencies = list(frequencies)
         self.amplitude = amplitude
-        self.channels = channels
-        if len(self.frequencies) != self.channels:
-            self.channels = len(self.frequencies)
+        self.channels = max(channels, len(self.frequencies))
+        # Repeat the frequencies so every channel has one, e.g. -c 2 -f 440 plays 440 Hz on both
+        self.frequencies = (self.frequencies * self.channels)[: self.channels]
         self.bitdepth = bitdepth
+        self._pa_format = _BITDEPTH_MAP[self.bitdepth]
+        self._sample_dtype = _SAMPLE_DTYPES[self.bitdepth]
         self.chunk_size = chunk_size
-        self.thetas = np.zeros(len(self.frequencies))
+        self._arange_chunk = np.arange(self.chunk_size, dtype=np.float64)
+        self._tile_blocks = max(1, self.RENDER_TILE_SAMPLES // self.chunk_size)
+        # Scratch for one render tile; every rotation lands here instead of in a fresh temporary
+        self._rotated = self._new_scratch()
+        self._reset_phasors()
+        self._out = np.empty(self.chunk_size * self.channels, dtype=np.float32)
+
+        # Playback ring: the audio thread renders chunks ahead, the stream callback only hands them out
+        self._ring = [np.empty_like(self._out, dtype=self._sample_dtype) for _ in range(self.RING_BUFFER_CHUNKS)]
+        self._silence = np.zeros_like(self._out, dtype=self._sample_dtype)
+        self._ring_free = None
+        self._ring_filled = None
+        self._ring_read_index = 0
+        self._ring_held = False
 
         self.stream = None
         self.exit_event = threading.Event()
@@ -96,6 +146,14 @@ class SineWaveGenerator:
         self.glitch_type = glitch_type
         self.glitch_size = glitch_size
         self.glitch_timer = 0
+        self._glitch_slice = slice(0, self.channels * glitch_size)
+        self._fullscale_click = np.ones(self.channels * glitch_size, dtype=np.float32)
+        self._glitch_handlers = {
+            GlitchType.NONE: lambda interleaved_chunk: None,
+            GlitchType.DROPOUT: self._apply_dropout,
+            GlitchType.SKIP: lambda interleaved_chunk: None,  # Applied before rendering, see _generate_chunk
+            GlitchType.FULLSCALE: self._apply_fullscale,
+        }
 
         # Glitch interval randomization settings
         self.random_glitch_interval = random_glitch_interval
@@ -127,62 +185,230 @@ class SineWaveGenerator:
             # Use fixed interval
             self.next_glitch_chunks = self.base_glitch_interval_chunks
 
-    def _get_pyaudio_format(self):
-        """Convert bit depth to PyAudio format constant."""
-        format_map = {16: pyaudio.paInt16, 24: pyaudio.paInt24, 32: pyaudio.paFloat32}
-        return format_map.get(self.bitdepth, pyaudio.paFloat32)
-
-    def _generate_sines(self, num_samples):
-        """Generate sine wave samples for all frequencies while maintaining phase continuity."""
-        delta_theta = (2 * np.pi * np.array(self.frequencies)) / self.sample_rate  # Δθ = 2πf / fs
-        theta_matrix = self.thetas[:, None] + np.arange(num_samples) * delta_theta[:, None]
-        sine_waves = (self.amplitude * np.sin(theta_matrix)).astype(np.float32)
-        self.thetas = (self.thetas + num_samples * delta_theta) % (2 * np.pi)
-        return np.column_stack(sine_waves).flatten()
+    def _reset_phasors(self):
+        """Reset the per-channel phasors and rebuild the cached per-frequency arrays."""
+        state = _OscillatorState(self.frequencies, self.sample_rate, self._arange_chunk)
+        self._build_period_table(state)
+        self._oscillator = state  # Publish only once it is complete
 
-    def _generate_chunk(self):
-        """Generate a chunk of sine wave samples with optional glitch effects."""
-        interleaved_chunk = self._generate_sines(self.chunk_size)
+    def _build_period_table(self, state):
+        """Cache one exact period of the signal when it is short, so rendering is a plain copy.
 
+        With integer frequencies and sample rate every channel repeats after fs / gcd(fs, f)
+        samples, so all of them repeat after the lcm of those. The table holds one period plus
+        one chunk, which keeps every chunk-sized window into it contiguous.
+        """
+        freqs_arr = state.freqs_arr
+        if self.sample_rate != int(self.sample_rate) or np.any(freqs_arr != np.round(freqs_arr)):
+            return
+        sample_rate = int(self.sample_rate)
+        freqs = freqs_arr.astype(np.int64)
+        period = math.lcm(*(sample_rate // math.gcd(sample_rate, int(freq)) for freq in freqs))
+        if (period + self.chunk_size) * len(freqs) * np.dtype(np.float32).itemsize > self.MAX_PERIOD_TABLE_BYTES:
+            return
+        # Reduce n·f modulo fs in integers first so the table phase is exact
+        cycles = np.multiply.outer(np.arange(period + self.chunk_size, dtype=np.int64), freqs) % sample_rate
+        state.period = period
+        state.period_table = np.sin(2 * np.pi * cycles / sample_rate).astype(np.float32)
+
+    def _new_scratch(self):
+        """Allocate complex scratch space for rotating one render tile."""
+        return np.empty(self.channels * self._tile_blocks * self.chunk_size, dtype=np.complex64)
+
+    def _rotate_phasors(self, state, first_sample, num_samples, scratch):
+        """Return sin(θ) per channel for num_samples starting first_sample past the current phasors.
+
+        Each sample is the imaginary part of phasor * e^(jnΔθ), taken from the precomputed
+        rotation table, so a sample costs one complex multiply instead of a sin evaluation.
+        The phasors are not advanced, so separate tiles can be computed independently.
+        num_samples must fit in one render tile, as the result is a view into scratch.
+        """
+        block_size = state.rotations.shape[1]
+        num_blocks = -(-num_samples // block_size)
+        block_starts = first_sample + block_size * np.arange(num_blocks)
+        block_phasors = state.phasors[:, None] * np.exp(1j * state.delta_theta[:, None] * block_starts)
+        scratch = scratch[: state.rotations.size * num_blocks].reshape(len(state.phasors), num_blocks, block_size)
+        np.multiply(block_phasors.astype(np.complex64)[:, :, None], state.rotations[:, None, :], out=scratch)
+        return scratch.reshape(len(state.phasors), -1)[:, :num_samples].imag
+
+    def _advance_phasors(self, state, num_samples):
+        """Rotate the phasors, or the offset into the cached period, forward by num_samples without rendering."""
+        if state.period_table is not None:
+            state.period_offset = (state.period_offset + num_samples) % state.period
+            return
+        phasors = state.phasors * np.exp(1j * num_samples * state.delta_theta)
+        phasors /= np.abs(phasors)  # Renormalize so the magnitude cannot drift
+        state.phasors = phasors
+
+    def _render_chunk(self, state, frames):
+        """Render one chunk of (chunk_size, channels) frames and advance the phasors, without allocating."""
+        rotated = self._rotated[: state.rotations.size].reshape(state.rotations.shape)
+        np.copyto(state.chunk_phasors, state.phasors[:, None])
+        np.multiply(state.rotations, state.chunk_phasors, out=rotated)
+        for channel, sine_wave in enumerate(rotated.imag):
+            np.multiply(sine_wave, self.amplitude, out=frames[:, channel])
+        np.multiply(state.phasors, state.chunk_step, out=state.phasors)
+        np.abs(state.phasors, out=state.magnitudes)
+        state.phasors /= state.magnitudes  # Renormalize so the magnitude cannot drift
+
+    def _render_from_period(self, state, frames):
+        """Copy (num_samples, channels) frames out of the cached period, chunk-sized window by window."""
+        for start in range(0, len(frames), self.chunk_size):
+            window = frames[start : start + self.chunk_size]
+            offset = state.period_offset
+            np.multiply(state.period_table[offset : offset + len(window)], self.amplitude, out=window)
+            state.period_offset = (offset + len(window)) % state.period
+
+    def _render_frames(self, state, frames, first_sample, scratch):
+        """Render (num_samples, channels) frames starting first_sample past the current phasors."""
+        tile_samples = self._tile_blocks * self.chunk_size
+        # Long requests are rendered tile by tile so the complex scratch stays cache-resident
+        for start in range(0, len(frames), tile_samples):
+            tile = frames[start : start + tile_samples]
+            # Scale each channel into its interleaved column: one long 1-D ufunc loop per channel is much
+            # faster than a single transposed 2-D pass whose innermost loop is only `channels` long
+            for channel, sine_wave in enumerate(self._rotate_phasors(state, first_sample + start, len(tile), scratch)):
+                np.multiply(sine_wave, self.amplitude, out=tile[:, channel])
+
+    def _generate_sines(self, num_samples, out=None):
+        """Generate sine wave samples for all frequencies while maintaining phase continuity.
+
+        Samples are interleaved into out, which defaults to the reusable chunk buffer.
+        The returned array is only valid until the next call, so callers must not keep it.
+        Long offline renders are split into spans rendered on a thread pool; NumPy releases
+        the GIL inside the ufunc loops, so the spans run in parallel.
+        """
+        if out is None:
+            if num_samples * self.channels <= len(self._out):
+                out = self._out[: num_samples * self.channels]
+            else:
+                out = np.empty(num_samples * self.channels, dtype=np.float32)
+        frames = out.reshape(num_samples, self.channels)
+        state = self._oscillator
+        if state.period_table is not None:
+            self._render_from_period(state, frames)
+            return out
+        if num_samples == self.chunk_size:
+            self._render_chunk(state, frames)
+            return out
+
+        num_workers = min(os.cpu_count() or 1, num_samples // self.PARALLEL_RENDER_SAMPLES)
+        if num_workers <= 1:
+            self._render_frames(state, frames, 0, self._rotated)
+        else:
+            tile_samples = self._tile_blocks * self.chunk_size
+            span = -(-num_samples // (num_workers * tile_samples)) * tile_samples
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                # Each span gets its own tile scratch; the shared one belongs to the realtime path
+                spans = [
+                    executor.submit(
+                        self._render_frames, state, frames[start : start + span], start, self._new_scratch()
+                    )
+                    for start in range(0, num_samples, span)
+                ]
+                for future in spans:
+                    future.result()
+
+        self._advance_phasors(state, num_samples)
+        return out
+
+    def _glitch_due(self):
+        """Advance the glitch timer by one chunk and return True when a glitch should fire."""
         if self.glitch_timer >= self.next_glitch_chunks:
             self.glitch_timer = 0
             self._set_next_glitch_interval()
-            if self.glitch_type == GlitchType.DROPOUT:
-                interleaved_chunk[: self.channels * self.glitch_size] = 0.0
-
-            elif self.glitch_type == GlitchType.SKIP:
-                samples_to_skip = self.channels * self.glitch_size
-                interleaved_chunk[:-samples_to_skip] = interleaved_chunk[samples_to_skip:]
-                new_samples = self._generate_sines(self.glitch_size)
-                interleaved_chunk[-len(new_samples) :] = new_samples
-
-            elif self.glitch_type == GlitchType.FULLSCALE:
-                fs_sample = -1.0 if interleaved_chunk[0] >= 0.0 else 1.0
-                interleaved_chunk[: self.channels * self.glitch_size] = fs_sample
-        else:
-            self.glitch_timer += 1
+            return True
+        self.glitch_timer += 1
+        return False
+
+    def _apply_dropout(self, interleaved_chunk):
+        """Silence the start of the chunk in place."""
+        interleaved_chunk[self._glitch_slice] = 0.0
+
+    def _apply_fullscale(self, interleaved_chunk):
+        """Overwrite the start of the chunk in place with a full-scale click against the signal's sign."""
+        segment = interleaved_chunk[self._glitch_slice]
+        np.copysign(self._fullscale_click[: len(segment)], -interleaved_chunk[0], out=segment)
+
+    def _generate_chunk(self, out=None):
+        """Generate a chunk of sine wave samples with optional glitch effects."""
+        if not self._glitch_due():
+            return self._generate_sines(self.chunk_size, out)
+
+        if self.glitch_type == GlitchType.SKIP:
+            # Skipped samples are never rendered, the phasors just rotate past them
+            self._advance_phasors(self._oscillator, self.glitch_size)
+        interleaved_chunk = self._generate_sines(self.chunk_size, out)
+        self._glitch_handlers[self.glitch_type](interleaved_chunk)
         return interleaved_chunk
 
+    def _to_sample_dtype(self, samples, out):
+        """Quantize float samples in [-1, 1] into the int16 array out, using samples as scratch."""
+        # Round to nearest rather than truncating, which would leave a dead zone around zero;
+        # |samples| <= 1, so the rounded values always fit and the unsafe cast cannot wrap
+        np.multiply(samples, np.iinfo(np.int16).max, out=samples)
+        np.rint(samples, out=samples)
+        np.copyto(out, samples, casting="unsafe")
+        return out
+
+    def _fill_ring_buffer(self, buffer):
+        """Render the next chunk into a playback ring buffer in the stream's sample format."""
+        if buffer.dtype == np.float32:
+            self._generate_chunk(out=buffer)
+        else:
+            self._to_sample_dtype(self._generate_chunk(), out=buffer)
+
+    def _pa_callback(self, in_data, frame_count, time_info, status):
+        """PyAudio stream callback, invoked from PortAudio's thread whenever it needs the next chunk."""
+        # PyAudio has copied the chunk returned last time by now, so it can go back to the producer
+        if self._ring_held:
+            self._ring_held = False
+            self._ring_free.release()
+
+        # Never block PortAudio's thread: if the producer fell behind, play silence for this chunk
+        if not self._ring_filled.acquire(blocking=False):
+            return self._silence, pyaudio.paContinue
+
+        chunk = self._ring[self._ring_read_index]
+        self._ring_read_index = (self._ring_read_index + 1) % len(self._ring)
+        self._ring_held = True
+        return chunk, pyaudio.paContinue
+
     def _play_audio(self):
-        """Main audio playback loop running in separate thread."""
+        """Render chunks into the playback ring while the stream callback plays them, until stop() is requested."""
+        # Prime the whole ring before the stream opens, so the first callbacks already have audio
+        for chunk in self._ring:
+            self._fill_ring_buffer(chunk)
+        self._ring_free = threading.Semaphore(0)
+        self._ring_filled = threading.Semaphore(len(self._ring))
+        self._ring_read_index = 0
+        self._ring_held = False
+        chunk_seconds = self.chunk_size / self.sample_rate
+
         self._pyaudio_instance = pyaudio.PyAudio()
 
         try:
             # Open an audio stream
             self.stream = self._pyaudio_instance.open(
-                format=self._get_pyaudio_format(),
+                format=self._pa_format,
                 channels=self.channels,
                 rate=self.sample_rate,
                 output=True,
                 frames_per_buffer=self.chunk_size,
+                stream_callback=self._pa_callback,
             )
 
             self.chunk_index = 0
 
             try:
+                write_index = 0
                 while not self.exit_event.is_set():
-                    sine_wave_chunk = self._generate_chunk()
-                    self.stream.write(sine_wave_chunk.tobytes())
+                    # Time out regularly so a stalled stream cannot keep stop() waiting
+                    if not self._ring_free.acquire(timeout=chunk_seconds):
+                        continue
+                    self._fill_ring_buffer(self._ring[write_index])
+                    self._ring_filled.release()
+                    write_index = (write_index + 1) % len(self._ring)
             finally:
                 # Clean up stream resources
                 if self.stream:
@@ -201,9 +427,12 @@ class SineWaveGenerator:
 
         Raises:
             RuntimeError: If audio thread is already running.
+            ValueError: If the bit depth is 24, which has no packed sample conversion yet.
         """
         if self.audio_thread is not None and self.audio_thread.is_alive():
             raise RuntimeError("Audio thread is already running")
+        if self.bitdepth == 24:
+            raise ValueError("24-bit playback is not supported yet, use 16 or 32 bits")
 
         if blocking is not None:
             self.blocking = blocking
@@ -237,16 +466,23 @@ class SineWaveGenerator:
     def set_frequencies(self, frequencies: list[float]):
         """Set the sine wave frequencies.
 
+        Fewer frequencies than channels are repeated across the channels.
+
         Args:
             frequencies (list[float]): List of frequencies in Hz
+
+        Raises:
+            ValueError: If there are more frequencies than channels
         """
+        if len(frequencies) > self.channels:
+            raise ValueError(f"Got {len(frequencies)} frequencies for {self.channels} channel(s)")
         for freq in frequencies:
             if freq <= 0:
                 raise ValueError(f"All frequencies must be positive, got {freq}")
             if freq > self.sample_rate / 2:
                 raise ValueError(f"Frequency {freq} Hz exceeds Nyquist limit ({self.sample_rate / 2} Hz)")
-        self.frequencies = frequencies
-        self.thetas = np.zeros(len(self.frequencies))  # Reset phase tracking
+        self.frequencies = (list(frequencies) * self.channels)[: self.channels]
+        self._reset_phasors()  # Reset phase tracking
 
     def save_to_wav(self, duration: int, filename: str):
         """
@@ -261,49 +497,34 @@ class SineWaveGenerator:
 
         # More efficient: generate all samples at once for clean audio
         if self.glitch_type == GlitchType.NONE:
-            samples = self._generate_clean_samples(num_samples)
+            samples = self._generate_sines(num_samples, out=np.empty(num_samples * self.channels, dtype=np.float32))
         else:
             samples = self._generate_samples_with_glitches(num_samples)
 
-        # Reshape and save
+        # Convert, reshape and save
+        if self._sample_dtype != np.float32:
+            samples = self._to_sample_dtype(samples, out=np.empty(samples.shape, dtype=self._sample_dtype))
         samples = samples.reshape(-1, self.channels)
         wavfile.write(filename, self.sample_rate, samples)
 
-    def _generate_clean_samples(self, num_samples):
-        """Generate clean sine wave samples efficiently without glitches."""
-        delta_theta = (2 * np.pi * np.array(self.frequencies)) / self.sample_rate
-        theta_matrix = self.thetas[:, None] + np.arange(num_samples) * delta_theta[:, None]
-        sine_waves = (self.amplitude * np.sin(theta_matrix)).astype(np.float32)
-        # Update phase tracking for next call
-        self.thetas = (self.thetas + num_samples * delta_theta) % (2 * np.pi)
-        return np.column_stack(sine_waves).flatten()
-
     def _generate_samples_with_glitches(self, num_samples):
-        """Generate samples with glitches using optimized chunked approach."""
-        num_chunks = num_samples // self.chunk_size
-        remaining_samples = num_samples % self.chunk_size
-
-        # Pre-allocate array for better performance
-        total_samples_needed = num_samples * self.channels
-        all_samples = np.empty(total_samples_needed, dtype=np.float32)
-
-        # Generate chunks
-        offset = 0
-        for _ in range(num_chunks):
-            chunk = self._generate_chunk()
-            chunk_size = len(chunk)
-            all_samples[offset : offset + chunk_size] = chunk
-            offset += chunk_size
-
-        # Handle remaining samples
-        if remaining_samples > 0:
-            original_chunk_size = self.chunk_size
-            self.chunk_size = remaining_samples
-            try:
-                chunk = self._generate_chunk()
-                chunk_size = len(chunk)
-                all_samples[offset : offset + chunk_size] = chunk
-            finally:
-                self.chunk_size = original_chunk_size
+        """Generate samples with glitches by rendering in bulk and patching each glitch in afterwards."""
+        # Replay the glitch timer chunk by chunk to find the chunks a glitch lands on
+        glitch_starts = [start for start in range(0, num_samples, self.chunk_size) if self._glitch_due()]
+        all_samples = np.empty(num_samples * self.channels, dtype=np.float32)
+        frames = all_samples.reshape(num_samples, self.channels)
+
+        if self.glitch_type == GlitchType.SKIP:
+            # Render the audio between glitches and jump the phase over the skipped samples
+            segment_start = 0
+            for start in glitch_starts:
+                self._generate_sines(start - segment_start, out=frames[segment_start:start].reshape(-1))
+                self._advance_phasors(self._oscillator, self.glitch_size)
+                segment_start = start
+            self._generate_sines(num_samples - segment_start, out=frames[segment_start:].reshape(-1))
+        else:
+            self._generate_sines(num_samples, out=all_samples)
+            for start in glitch_starts:
+                self._glitch_handlers[self.glitch_type](frames[start : start + self.chunk_size].reshape(-1))
 
         return all_samples